@@ -0,0 +1,88 @@
+from __future__ import annotations
+from typing import Any, Callable
+
+import sys
+import json
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from traceback import format_exc
+
+
+#
+# This file provides helpers for scripts that process many files at once:
+# a cache of processed files, so that a run only processes files that changed since the last one,
+# and processing in parallel worker processes.
+#
+# Workers are given the settings of the script that started the batch.
+# Under the spawn start method workers import the script again with the values in its file,
+# so settings changed at runtime (e.g. by script_runner.py) would otherwise be lost.
+# Scripts with precomputed tables have them built again with their build_tables function.
+#
+#
+# == EXAMPLE USAGE ==
+#
+#  cache = read_cache(cache_file)
+#  jobs = [(input_path, output_path, key, entry) for ... if cache.get(key, None) != entry]
+#  failed_count = process_in_workers(convert_file, jobs, cache, settings, workers)
+#  write_cache(cache_file, cache)
+#
+
+
+def read_cache(cache_file: str | None) -> dict[str, Any]:
+    """Cache entries by key from the json cache file. Empty if there is no cache file or it does not exist yet."""
+    if cache_file is None or not Path(cache_file).is_file():
+        return dict()
+    return json.loads(Path(cache_file).read_text())
+
+
+def write_cache(cache_file: str | None, cache: dict[str, Any]):
+    if cache_file is not None:
+        Path(cache_file).write_text(json.dumps(cache, indent=2))
+
+
+def apply_settings(process: Callable[[Path, Path], Any], settings: dict[str, Any]):
+    """Initializer of worker processes. Sets the settings in the module of the process function."""
+
+    module = sys.modules[process.__module__]
+    vars(module).update(settings)
+
+    if hasattr(module, "build_tables"):
+        module.build_tables()
+
+
+def process_in_workers(
+        process: Callable[[Path, Path], Any],
+        jobs: list[(Path, Path, str, Any)],
+        cache: dict[str, Any],
+        settings: dict[str, Any],
+        workers: int | None = None
+    ) -> int:
+    """
+    Calls process with the input and output path of each job (input, output, cache key, cache entry)
+    in worker processes with the settings applied. Sets the cache entries of the jobs that succeeded
+    and prints the errors of the ones that failed. Returns the number of failed jobs.
+    """
+
+    if len(jobs) == 0:
+        return 0
+
+    failed_count = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=apply_settings, initargs=(process, settings)) as executor:
+
+        futures = {
+            executor.submit(process, input_path, output_path): (input_path, cache_key, cache_entry)
+            for input_path, output_path, cache_key, cache_entry in jobs
+        }
+
+        for future in as_completed(futures):
+            input_path, cache_key, cache_entry = futures[future]
+            try:
+                future.result()
+                cache[cache_key] = cache_entry
+            except Exception:
+                failed_count += 1
+                print(f"An error has occurred while processing \"{input_path}\":")
+                print(format_exc())
+
+    return failed_count
@@ -53,10 +53,10 @@ class MatrixSeriesWriter:
         self.file.write(f"{size[0]}\n")	# Height
         self.file.write(f"{size[1]}\n")	# Width
         
-        # Values in reading order
-        for row in mat:
-            for val in row:
-                self.file.write(f"{val}\n")
+        # Values in reading order, written in one go
+        if mat.size > 0:
+            self.file.write("\n".join(map(str, mat.ravel().tolist())))
+            self.file.write("\n")
 
 
 class MatrixSeriesReader:
@@ -87,12 +87,8 @@ class MatrixSeriesReader:
         height = int(firstLine)
         width = int(self.file.readline().strip())
 
-        # Make array
-        mat: NDArray = np.empty((height, width))
-
-        # Read values in reading order
-        for i in range(height):
-            for j in range(width):
-                mat[i, j] = int(self.file.readline().strip())
+        # Read values in reading order and parse them all at once
+        lines = [self.file.readline() for _ in range(height * width)]
+        mat: NDArray = np.array(lines, dtype=float).reshape((height, width))
 
         return mat
@@ -1,11 +1,31 @@
 from __future__ import annotations
-from typing import Final, Iterable, Callable, Any, TypeVar
-
+from typing import TYPE_CHECKING, Final, Iterable, Callable, TypeVar, TextIO, BinaryIO, Any
+
+import sys
+import json
+import zlib
+import struct
+from glob import glob
+from hashlib import sha256
+from io import BytesIO, StringIO
+from time import perf_counter
+from base64 import b64encode
 from pathlib import Path
-from textwrap import wrap
+from threading import Lock
+from collections import deque, Counter, OrderedDict
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+import re
 from itertools import chain
 from traceback import format_exc
 
+import numpy as np
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
 
 # == PROBLEM ==
 # Given a string of text, generate an svg image with
@@ -25,8 +45,37 @@ from traceback import format_exc
 # Path to the file with text to spell out
 input_file: Final[str] = "script.txt"
 # Filename to write resulting image into.
-# Supports {name} for input file name without extension.
-output_file: Final[str] = "{name}.generated.svg"
+# Supports {name} for input file name without extension and {extension} for output type.
+output_file: Final[str] = "{name}.generated.{extension}"
+# Type of the resulting image: "svg" or "png"
+output_type: Final[str] = "svg"
+
+# Directory or glob of input files to render all at once instead of the input file, or None.
+# Only .txt files are rendered: all of them in a directory or the ones the glob matches.
+# Each image is written next to its input file.
+batch_input: Final[str | None] = None
+# Number of processes rendering in parallel in batch mode, or None for one per processor
+batch_workers: Final[int | None] = None
+# File to remember rendered inputs in, so that batch mode only renders inputs
+# that changed along with the settings since the last run, or None to always render everything
+render_cache_file: Final[str | None] = "color_tokki_render_cache.json"
+
+# Wether to remember rendered lines next to the output file, so that when the input
+# is edited only the lines that changed or moved are rendered again. Svg output only.
+incremental_rendering: Final[bool] = False
+
+# Wether to run as a render service instead: "http", "stdin" (json lines) or None.
+# The service keeps all tables in memory between renders, see serve_http and serve_stdin.
+# Renders share the settings of this script, so the service renders one request at a time,
+# even though the http service accepts requests concurrently.
+serve_mode: Final[str | None] = None
+# Host and port of the http render service
+server_address: Final[(str, int)] = ("127.0.0.1", 8765)
+# Number of distinct sets of settings with overrides to keep built tables for, least recently used are dropped
+overridden_tables_size: Final[int] = 16
+
+# Wether to wait for enter to be pressed before exiting
+pause_on_exit: Final[bool] = True
 
 # The width of one horizontal rectangle in em.
 # A glyph takes 1 width by 1 width rectangle space and has no padding.
@@ -52,6 +101,17 @@ spaces_become_line_breaks: Final[bool] = True
 # Requires extended alphabet to have an effect, otherwise False.
 inline_line_breaks: Final[bool] = False
 
+# Wether to define each distinct glyph once and place glyphs with short references to it (True)
+# or to write out rectangles of every glyph (False). Compact output is several times smaller.
+compact_output: Final[bool] = False
+# Number of decimal places to round coordinates to in compact output, or None for no rounding
+coordinate_precision: Final[int | None] = 4
+
+# Pixels per em in png output. All edges are rounded to whole pixels.
+png_pixels_per_em: Final[int] = 16
+# Background color of png output, in the same format as palette colors
+png_background_color: Final[str] = "#FFFFFF00"
+
 
 # ======== ALPHABET ======== #
 # The color palette of svg (css) colors.
@@ -187,12 +247,17 @@ glyph_unknown: Final[(str, str)] = ("oBW3", "oBW3")
 svg_template: Final[str] = """
 <svg version="1.1"
      width="{width}em" height="{height}em"
-     xmlns="http://www.w3.org/2000/svg">
+     xmlns="http://www.w3.org/2000/svg"
+     xmlns:xlink="http://www.w3.org/1999/xlink">
 {content}
 </svg>
 """
 rect_template: Final[str] = """<rect x="{x}em" y="{y}em" width="{width}em" height="{height}em" fill="{color}" />"""
 rect_outline_template: Final[str] = """<rect x="{x}em" y="{y}em" width="{width}em" height="{height}em" fill="{fill_color}" stroke="{outline_color}" stroke-width="{outline_width}em" />"""
+# Compact output only
+glyph_definitions_template: Final[str] = """<defs>\n{definitions}\n</defs>\n"""
+glyph_definition_template: Final[str] = """<g id="{id}">{rectangles}</g>"""
+glyph_use_template: Final[str] = """<use xlink:href="#{id}" x="{x}em" y="{y}em" />"""
 
 # Measurements (based on pixel measurements)
 # Each glyph takes 1 width by 1 width square
@@ -203,49 +268,115 @@ rectangle_first_offset_in_widths: Final[float] = 0.5 - rectangle_same_glyph_dist
 rectangle_second_offset_in_widths: Final[float] = rectangle_first_offset_in_widths + rectangle_height_in_widths + rectangle_same_glyph_distance_in_widths
 
 
-# ======== UTILS AND GENERATION ======== #
-T = TypeVar("T")
-U = TypeVar("U")
-def select_many(delegate: Callable[[T], Iterable[U]], iterable: Iterable[T]) -> Iterable[U]:
-    return chain.from_iterable(map(delegate, iterable))
-    
+# ======== PRECOMPUTED TABLES ======== #
+def build_glyph_geometry() -> tuple[(int, int, (float, float, float, float), (float, float, float, float)), ...]:
+    """
+    Builds the pair position within a block, in rectangle widths, and the top and bottom rectangles
+    of a glyph for each position within a block of 4 glyphs.
+    Rectangles are (x, y, width, height) in em, relative to the pair.
+    """
 
-def find_rectangle_position(
-        line_index: int,
-        column_index: int
-    ) -> (float, float, bool): # pair_x_abs, pair_y_abs, is_vertical
+    table = list()
+    for position_within_block in range(4):
 
-    # Calculate block position (group of 4)
-    # all positions are in rectangle widths
-    block_x = column_index // 4
-    block_y = line_index
-    position_within_block = column_index % 4
+        # Pair position within the block, in rectangle widths
+        pair_x = 1 if position_within_block > 1 else 0
+        pair_y = 1 if position_within_block % 2 == 1 else 0
+        is_vertical = position_within_block == 1 or position_within_block == 2
 
-    # Based on block position calculate the pair position
-    pair_x_absolute: float = block_x * 2
-    pair_y_absolute: float = block_y * 2
+        pair = list()
+        for offset in (rectangle_first_offset_in_widths, rectangle_second_offset_in_widths):
 
-    if position_within_block > 1:
-        pair_x_absolute += 1
-    
-    if position_within_block % 2 == 1:
-        pair_y_absolute += 1
+            # Rectangle with relative positioning
+            x, y = 0, offset * glyph_size
+            width, height = glyph_size, rectangle_height_in_widths * glyph_size
+
+            # Rotate the pair
+            if is_vertical:
+                x, y = y, x
+                width, height = height, width
+
+            pair.append((x, y, width, height))
+
+        table.append((pair_x, pair_y, *pair))
+
+    return tuple(table)
+
+
+def build_glyph_colors() -> dict[str, (str | (str, str), str | (str, str))]:
+    """Resolves top and bottom colors of every known character, with the alphabet taking priority over the extension"""
+
+    letters = dict(alphabet_extension) if use_extended_alphabet else dict()
+    letters.update(alphabet)
+
+    return {
+        character: (resolve_color(top_key), resolve_color(bottom_key))
+        for character, (top_key, bottom_key) in letters.items()
+    }
+
+
+def resolve_color(key: str) -> str | (str, str):
+    """Color of a palette key. Outline colors given as lists (e.g. from json) become tuples."""
+    color = color_palette[key]
+    return tuple(color) if isinstance(color, list) else color
+
+
+def build_glyph_color_pairs(
+        colors: dict[str, (str | (str, str), str | (str, str))],
+        unknown_colors: (str | (str, str), str | (str, str))
+    ) -> list[(str | (str, str), str | (str, str))]:
+    """Distinct color pairs of the characters and the unknown glyph, in order of first use"""
+    return list(dict.fromkeys((*colors.values(), unknown_colors)))
+
+
+def find_line_separation_in_widths() -> float:
+    return 0 if use_extended_alphabet and inline_line_breaks else line_separation_height
 
-    if pair_x_absolute >= image_width:
-        print(f"Character at wrapped row {line_index+1} col {column_index+1} is out of bound of {image_width} characters width area")
 
-    is_vertical = position_within_block == 1 or position_within_block == 2
+# Glyph rectangles by column index % 4
+glyph_geometry = build_glyph_geometry()
+# Top and bottom colors by character
+glyph_colors = build_glyph_colors()
+glyph_unknown_colors = (resolve_color(glyph_unknown[0]), resolve_color(glyph_unknown[1]))
+# Distinct color pairs and their numbers, used to number glyph definitions in compact output
+glyph_color_pairs = build_glyph_color_pairs(glyph_colors, glyph_unknown_colors)
+glyph_color_numbers = {color_pair: number for number, color_pair in enumerate(glyph_color_pairs)}
+# Line separation in rectangle widths, if line breaks are not inlined
+line_separation_in_widths = find_line_separation_in_widths()
 
-    # Add line separation if line breaks are not inlined
-    if not use_extended_alphabet or not inline_line_breaks:
-        pair_y_absolute += line_separation_height * line_index
 
-    # Return
-    return (pair_x_absolute, pair_y_absolute, is_vertical)
+def build_tables():
+    """Builds all precomputed tables again. Needs to be called if settings are changed at runtime."""
 
+    global glyph_geometry, glyph_colors, glyph_unknown_colors, glyph_color_pairs, glyph_color_numbers
+    global line_separation_in_widths
 
-def create_rectangle(x, y, width, height, color: str | (str, str)):
+    glyph_geometry = build_glyph_geometry()
+    glyph_colors = build_glyph_colors()
+    glyph_unknown_colors = (resolve_color(glyph_unknown[0]), resolve_color(glyph_unknown[1]))
+    glyph_color_pairs = build_glyph_color_pairs(glyph_colors, glyph_unknown_colors)
+    glyph_color_numbers = {color_pair: number for number, color_pair in enumerate(glyph_color_pairs)}
+    line_separation_in_widths = find_line_separation_in_widths()
+
+
+# ======== UTILS AND GENERATION ======== #
+T = TypeVar("T")
+U = TypeVar("U")
+def select_many(delegate: Callable[[T], Iterable[U]], iterable: Iterable[T]) -> Iterable[U]:
+    return chain.from_iterable(map(delegate, iterable))
+    
+
+def format_coordinate(value: float, precision: int | None) -> float | str:
+    """Rounds the value to precision, dropping the fractional part of whole numbers. None precision keeps the value as is."""
+    if precision is None:
+        return value
+    value = round(value, precision)
+    return str(int(value)) if value == int(value) else str(value)
+
+
+def create_rectangle(x, y, width, height, color: str | (str, str), precision: int | None = None):
     if isinstance(color, str):
+        x, y, width, height = (format_coordinate(value, precision) for value in (x, y, width, height))
         return rect_template.format(x=x, y=y, width=width, height=height, color=color)
     else:
         # Keep outline inside the rectangle
@@ -253,8 +384,19 @@ def create_rectangle(x, y, width, height, color: str | (str, str)):
         y += outline_size/2
         width -= outline_size
         height -= outline_size
+        x, y, width, height, outline_width = (format_coordinate(value, precision) for value in (x, y, width, height, outline_size))
         # Crate the rectangle
-        return rect_outline_template.format(x=x, y=y, width=width, height=height, fill_color=color[0], outline_color=color[1], outline_width=outline_size)
+        return rect_outline_template.format(x=x, y=y, width=width, height=height, fill_color=color[0], outline_color=color[1], outline_width=outline_width)
+
+
+def find_glyph_position(line_index: int, column_index: int) -> (float, float):
+    """Finds the absolute position of the rectangle pair of a glyph, in em"""
+
+    pair_x, pair_y, _, _ = glyph_geometry[column_index % 4]
+    x_offset = ((column_index // 4) * 2 + pair_x) * glyph_size
+    y_offset = (line_index * 2 + pair_y + line_index * line_separation_in_widths) * glyph_size
+
+    return (x_offset, y_offset)
 
 
 def generate_rectangle_pair(
@@ -264,153 +406,935 @@ def generate_rectangle_pair(
         bottom_color: str | (str, str)
     ) -> (str, str):
 
-    pair_data: (dict[str, Any], dict[str, Any]) = (dict(), dict())
-
-    # Create rectangles with relative positioning
-    pair_data[0]["x"] = 0
-    pair_data[1]["x"] = pair_data[0]["x"]
-    pair_data[0]["y"] = rectangle_first_offset_in_widths * glyph_size
-    pair_data[1]["y"] = rectangle_second_offset_in_widths * glyph_size
-    pair_data[0]["width"] = glyph_size
-    pair_data[1]["width"] = pair_data[0]["width"]
-    pair_data[0]["height"] = rectangle_height_in_widths * glyph_size
-    pair_data[1]["height"] = pair_data[0]["height"]
-
-    # Offset to absolute positions and rotate the pair
-    x_offset, y_offset, is_vertical = find_rectangle_position(line_index, column_index)
-
-    if is_vertical:
-        for i in range(2):
-            pair_data[i]["x"], pair_data[i]["y"] = pair_data[i]["y"], pair_data[i]["x"]
-            pair_data[i]["width"], pair_data[i]["height"] = pair_data[i]["height"], pair_data[i]["width"]
-
-    pair_data[0]["x"] += x_offset * glyph_size
-    pair_data[1]["x"] += x_offset * glyph_size
-    pair_data[0]["y"] += y_offset * glyph_size
-    pair_data[1]["y"] += y_offset * glyph_size
+    # Offset precomputed rectangles of the block position to absolute position
+    x_offset, y_offset = find_glyph_position(line_index, column_index)
+    _, _, top, bottom = glyph_geometry[column_index % 4]
 
     # Create and return
     return (
-        create_rectangle(**pair_data[0], color=top_color),
-        create_rectangle(**pair_data[1], color=bottom_color)
+        create_rectangle(top[0] + x_offset, top[1] + y_offset, top[2], top[3], color=top_color),
+        create_rectangle(bottom[0] + x_offset, bottom[1] + y_offset, bottom[2], bottom[3], color=bottom_color)
     )
 
 
-def main():
-
-    # Check some settings
-    if image_width < 1:
-        print("Image width must be at least 1 characters. Aborting.")
-        return
-    
-    # Read input file
-    print("Reading input file...")
-    input_file_path = Path(input_file)
-    if not (input_file_path.exists() and input_file_path.is_file()):
-        print(f"File \"{input_file}\" does not exist or is not a file.")
-        return
-
-    text = input_file_path.read_text()
+def split_text_lines(input_lines: Iterable[str]) -> Iterable[str]:
+    """
+    Lazily splits lines of the input text into wrapped lines according to the settings.
+    Input lines can be lines of a file, as they are split the same way as the whole text would be.
+    """
 
-    # Splitting into lines
-    print("Splitting into lines according to chosen settings...")
-    text_lines: list[str]
+    # Same as splitting the whole text with str.splitlines
+    text_lines = select_many(str.splitlines, input_lines)
 
     if use_extended_alphabet:
 
         if inline_line_breaks:
 
-            # First normalize line breaks to all be "\n"
-            text = "\n".join(text.splitlines())
+            # Line breaks are normalized to all be "\n" when joining the lines back
+            batching_width = image_width * 2
+            buffer = ""
 
-            # Replace spaces if needed
-            if spaces_become_line_breaks:
-                text = text.replace(' ', '\n')
+            for i, line in enumerate(text_lines):
+
+                if i > 0:
+                    buffer += "\n"
+
+                # Replace spaces if needed
+                buffer += line.replace(' ', '\n') if spaces_become_line_breaks else line
+
+                # Batch by how many characters fit
+                batch_start = 0
+                while len(buffer) - batch_start >= batching_width:
+                    yield buffer[batch_start:batch_start+batching_width]
+                    batch_start += batching_width
+                buffer = buffer[batch_start:]
+
+            if len(buffer) > 0:
+                yield buffer
 
-            # Batch by how many characters fit
-            batching_width = image_width * 2
-            text_lines = [text[i:i+batching_width] for i in range(0, len(text), batching_width)]
-       
         else:
-            
-            # First split by new lines
-            text_lines = text.splitlines()
 
-            # Then split by spaces
+            # Split by spaces
             if spaces_become_line_breaks:
-                text_lines = list(select_many(lambda line: line.split('\n'), text_lines))
+                text_lines = select_many(lambda line: line.split('\n'), text_lines)
 
             # Then wrap it around but keep empty lines
-            text_lines = list(select_many(
-                lambda s: ("",) if len(s.strip()) == 0 else wrap(s, width=image_width*2, replace_whitespace=False),
+            yield from select_many(
+                lambda s: ("",) if len(s.strip()) == 0 else wrap_line(s, image_width*2),
                 text_lines
+            )
+
+    else:
+
+        # Split each line on space
+        yield from select_many(lambda line: line.split(' '), text_lines)
+
+
+def generate_glyph_definition(
+        glyph_id: str,
+        position_within_block: int,
+        top_color: str | (str, str),
+        bottom_color: str | (str, str)
+    ) -> str:
+
+    # Rectangles are relative to the glyph position
+    _, _, top, bottom = glyph_geometry[position_within_block]
+    rectangles = (
+        create_rectangle(*top, color=top_color, precision=coordinate_precision),
+        create_rectangle(*bottom, color=bottom_color, precision=coordinate_precision)
+    )
+    return glyph_definition_template.format(id=glyph_id, rectangles="".join(rectangles))
+
+
+class LayoutDiagnostics:
+    """Problems found during layout, counted and reported once per render instead of once per character"""
+
+    unknown_characters: Counter[str]
+    out_of_bound_count: int
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        self.unknown_characters = Counter()
+        self.out_of_bound_count = 0
+
+    def add(self, unknown_characters: dict[str, int], out_of_bound_count: int):
+        """Adds problems counted elsewhere, such as ones of a line reused from a previous render"""
+        self.unknown_characters.update(unknown_characters)
+        self.out_of_bound_count += out_of_bound_count
+
+    def report(self):
+
+        unknown_count = self.unknown_characters.total()
+        if unknown_count > 0:
+            action = "replaced with the unknown glyph" if keep_unknown_characters else "skipped"
+            most_common = ", ".join(f"{repr(character)} x{count}" for character, count in self.unknown_characters.most_common(10))
+            print(f"{unknown_count} characters are not defined in the alphabet and were {action}. Most common: {most_common}")
+
+        if self.out_of_bound_count > 0:
+            print(f"{self.out_of_bound_count} characters are out of bound of {image_width} characters width area")
+
+
+# Diagnostics of the current render
+layout_diagnostics: Final = LayoutDiagnostics()
+
+# Chunks of a line when wrapping: whitespace, em-dashes and words, which are split after hyphens between letters.
+# Same as textwrap's word separator.
+word_separator_pattern: Final = re.compile(r"""
+    ( # whitespace
+      [\t\n\x0b\x0c\r ]+
+    | # em-dash between words
+      (?<=[\w!"'&.,?]) -{2,} (?=\w)
+    | # word, possibly hyphenated
+      [^\t\n\x0b\x0c\r ]+? (?:
+        # hyphenated word
+          -(?: (?<=[^\d\W]{2}-) | (?<=[^\d\W]-[^\d\W]-))
+          (?= [^\d\W] -? [^\d\W])
+        | # end of word
+          (?=[\t\n\x0b\x0c\r ]|\Z)
+        | # em-dash
+          (?<=[\w!"'&.,?]) (?=-{2,}\w)
+        )
+    )""", re.VERBOSE)
+
+
+def wrap_line(line: str, width: int) -> list[str]:
+    """
+    Wraps a line into lines at most width characters long in one pass over its chunks.
+    Lines are broken on whitespace, which is dropped around the breaks, and after hyphens,
+    and words longer than width are broken to fill the line, after their last hyphen that fits if there is one.
+    Same as textwrap.wrap without replacing whitespace.
+    """
+
+    if width < 1:
+        raise ValueError(f"Invalid width {width} (must be at least 1)")
+
+    chunks = [chunk for chunk in word_separator_pattern.split(line.expandtabs()) if chunk != ""]
+    chunk_count = len(chunks)
+    chunk_index = 0
+    lines: list[str] = list()
+
+    while chunk_index < chunk_count:
+
+        # Drop whitespace at the start of all but the first line
+        if len(lines) > 0 and chunks[chunk_index].strip() == "":
+            chunk_index += 1
+            if chunk_index == chunk_count:
+                break
+
+        # Take as many chunks as fit
+        line_chunks: list[str] = list()
+        line_length = 0
+        while chunk_index < chunk_count and line_length + len(chunks[chunk_index]) <= width:
+            line_chunks.append(chunks[chunk_index])
+            line_length += len(chunks[chunk_index])
+            chunk_index += 1
+
+        # Break a chunk that does not fit even on its own line to fill the rest of the line,
+        # after its last hyphen that fits if there are other characters before it.
+        # A full line gets an empty piece, which keeps its trailing whitespace like textwrap does.
+        if chunk_index < chunk_count and len(chunks[chunk_index]) > width:
+            chunk = chunks[chunk_index]
+            space_left = width - line_length
+            hyphen = chunk.rfind("-", 0, space_left)
+            if hyphen > 0 and chunk[:hyphen].strip("-") != "":
+                space_left = hyphen + 1
+            line_chunks.append(chunk[:space_left])
+            chunks[chunk_index] = chunk[space_left:]
+
+        # Drop whitespace (or an empty piece) at the end of the line
+        if len(line_chunks) > 0 and line_chunks[-1].strip() == "":
+            line_chunks.pop()
+
+        if len(line_chunks) > 0:
+            lines.append("".join(line_chunks))
+
+    return lines
+
+
+def layout_line(line: str) -> list[(int, (str | (str, str), str | (str, str)))]:
+    """Finds the column index and top and bottom colors of each glyph in a wrapped line"""
+
+    color_pairs = list(map(glyph_colors.get, line.upper()))
+
+    # Handle unknown characters
+    if None in color_pairs:
+        layout_diagnostics.unknown_characters.update(
+            character for character, color_pair in zip(line.upper(), color_pairs) if color_pair is None
+        )
+        if keep_unknown_characters:
+            color_pairs = [glyph_unknown_colors if color_pair is None else color_pair for color_pair in color_pairs]
+        else:
+            color_pairs = [color_pair for color_pair in color_pairs if color_pair is not None]
+
+    # Columns past the image width
+    layout_diagnostics.out_of_bound_count += max(len(color_pairs) - image_width * 2, 0)
+
+    return list(enumerate(color_pairs))
+
+
+def render_line(line_index: int, line: str, used_glyphs: set[int] | None = None) -> str:
+    """
+    Renders rectangles of all glyphs in a wrapped line, separated by new lines.
+    If a set of used glyphs is given, renders references to glyph definitions instead
+    and adds numbers of the referenced glyphs to the set.
+    """
+
+    rectangles: list[str] = list()
+
+    for col_index, color_pair in layout_line(line):
+
+        if used_glyphs is None:
+
+            # Create the rectangles
+            rectangles.extend(generate_rectangle_pair(line_index, col_index, *color_pair))
+
+        else:
+
+            # Reference the glyph definition
+            glyph_number = glyph_color_numbers[color_pair] * 4 + col_index % 4
+            used_glyphs.add(glyph_number)
+
+            x, y = find_glyph_position(line_index, col_index)
+            rectangles.append(glyph_use_template.format(
+                id=f"g{glyph_number}",
+                x=format_coordinate(x, coordinate_precision),
+                y=format_coordinate(y, coordinate_precision)
             ))
-        
+
+    return "\n".join(rectangles)
+
+
+def render_lines(text_lines: Iterable[str], used_glyphs: set[int] | None) -> Iterable[str]:
+    for line_index, line in enumerate(text_lines):
+        yield render_line(line_index, line, used_glyphs)
+
+
+def render_lines_incrementally(
+        text_lines: Iterable[str],
+        used_glyphs: set[int] | None,
+        cache_file_path: Path,
+        is_verbose: bool = True
+    ) -> Iterable[str]:
+    """
+    Renders lines, reusing the rendered lines of the previous render that have the same text and position.
+    Verbose rendering prints how many lines were reused.
+    The cache has the settings hash on the first line and then a rendered line per line,
+    with the glyphs it uses and the layout problems found in it, which are reported again when it is reused.
+    It is read and rewritten along with rendering, so it is never fully in memory.
+    """
+
+    settings_hash = hash_settings()
+    new_cache_file_path = cache_file_path.with_name(cache_file_path.name + ".tmp")
+    line_count = 0
+    reused_line_count = 0
+
+    # Only use the previous cache if it was made with the same settings
+    old_cache = cache_file_path.open() if cache_file_path.is_file() else None
+    if old_cache is not None and old_cache.readline().strip() != json.dumps(settings_hash):
+        old_cache.close()
+        old_cache = None
+
+    try:
+        with new_cache_file_path.open("w") as new_cache:
+
+            new_cache.write(json.dumps(settings_hash))
+            new_cache.write("\n")
+
+            for line_index, line in enumerate(text_lines):
+
+                line_count += 1
+
+                # Cached line at the same position
+                cached_line = None
+                if old_cache is not None:
+                    cached_line_string = old_cache.readline()
+                    if cached_line_string != "":
+                        cached_line = json.loads(cached_line_string)
+
+                # Reuse the cached line if its text is the same, reporting its layout problems again
+                if cached_line is not None and cached_line[0] == line:
+                    _, rendered_line, line_glyphs, line_unknown_characters, line_out_of_bound_count = cached_line
+                    layout_diagnostics.add(line_unknown_characters, line_out_of_bound_count)
+                    reused_line_count += 1
+                else:
+                    # Layout problems of the line are the ones added while rendering it
+                    unknown_characters_before = layout_diagnostics.unknown_characters.copy()
+                    out_of_bound_count_before = layout_diagnostics.out_of_bound_count
+
+                    line_glyphs = set() if used_glyphs is not None else None
+                    rendered_line = render_line(line_index, line, line_glyphs)
+                    line_glyphs = sorted(line_glyphs) if line_glyphs is not None else list()
+
+                    line_unknown_characters = dict(layout_diagnostics.unknown_characters - unknown_characters_before)
+                    line_out_of_bound_count = layout_diagnostics.out_of_bound_count - out_of_bound_count_before
+
+                if used_glyphs is not None:
+                    used_glyphs.update(line_glyphs)
+
+                new_cache.write(json.dumps([line, rendered_line, line_glyphs, line_unknown_characters, line_out_of_bound_count]))
+                new_cache.write("\n")
+
+                yield rendered_line
+
+    finally:
+        if old_cache is not None:
+            old_cache.close()
+
+    new_cache_file_path.replace(cache_file_path)
+    if is_verbose:
+        print(f"Reused {reused_line_count} of {line_count} lines from the previous render...")
+
+
+def write_rendered_lines(rendered_lines: Iterable[str], output: TextIO) -> int:
+    """Writes rendered lines to the output, separating all rectangles by new lines. Returns the number of lines."""
+
+    line_count = 0
+    is_first_rectangle = True
+
+    for rendered_line in rendered_lines:
+
+        line_count += 1
+
+        # Empty lines have no rectangles
+        if rendered_line == "":
+            continue
+
+        if not is_first_rectangle:
+            output.write("\n")
+        output.write(rendered_line)
+        is_first_rectangle = False
+
+    return line_count
+
+
+def find_image_height(line_count: int) -> float:
+    """Image height in em"""
+    return line_count * (2 * glyph_size) + line_count * line_separation_in_widths
+
+
+def render_svg(text_lines: Iterable[str], output: TextIO, line_cache_file_path: Path | None = None, is_verbose: bool = True):
+    """
+    Renders svg image into the output. Renders incrementally if the line cache file is given.
+    Verbose rendering prints progress and layout problems, which are in layout diagnostics either way.
+    """
+
+    layout_diagnostics.reset()
+    used_glyphs = set() if compact_output else None
+
+    if line_cache_file_path is not None:
+        rendered_lines = render_lines_incrementally(text_lines, used_glyphs, line_cache_file_path, is_verbose)
     else:
-        
-        # Split on new lines,
-        # then split each line on space
-        text_lines = list(select_many(
-            lambda line: line.split(' '),
-            text.splitlines()
-        ))
-    
+        rendered_lines = render_lines(text_lines, used_glyphs)
 
-    # Generate image
-    print("Generating image...")
-    rectangles: list[str] = list()  # I wish i could preallocate certain length
+    # The image height is only known after all lines are generated,
+    # so rectangles are streamed into a temporary file first
+    with TemporaryFile("w+") as content:
+
+        line_count = write_rendered_lines(rendered_lines, content)
+        if is_verbose:
+            layout_diagnostics.report()
+
+        # Create the image
+        image_head, image_tail = svg_template.split("{content}")
+
+        # Write to output
+        if is_verbose:
+            print("Writing output...")
+        output.write(image_head.format(width=image_width*glyph_size, height=find_image_height(line_count)))
+        if used_glyphs:
+            definitions = (
+                generate_glyph_definition(f"g{glyph_number}", glyph_number % 4, *glyph_color_pairs[glyph_number // 4])
+                for glyph_number in sorted(used_glyphs)
+            )
+            output.write(glyph_definitions_template.format(definitions="\n".join(definitions)))
+        content.seek(0)
+        copyfileobj(content, output)
+        output.write(image_tail)
+
+
+# ======== RASTER OUTPUT ======== #
+def parse_color(color: str) -> (int, int, int, int):
+    """Parses a hex color (#RGB, #RGBA, #RRGGBB or #RRGGBBAA) into RGBA"""
+
+    digits = color.removeprefix("#")
+    if not color.startswith("#") or len(digits) not in (3, 4, 6, 8):
+        raise ValueError(f"Color {repr(color)} is not supported in png output. Only hex colors are supported.")
+
+    # Expand short form
+    if len(digits) <= 4:
+        digits = "".join(digit * 2 for digit in digits)
+
+    # Add opaque alpha
+    if len(digits) == 6:
+        digits += "FF"
+
+    return tuple(bytes.fromhex(digits))
+
+
+def fill_pixel_rectangles(canvas: NDArray, xs: NDArray, ys: NDArray, width: int, height: int, color: str):
+    """
+    Blends the color over the canvas in rectangles of the same size at the given pixel positions, all at once.
+    Each pixel must be filled at most once for blending to be correct.
+    """
+
+    rgba = np.array(parse_color(color), dtype=np.uint8)
+    if rgba[3] == 0 or width <= 0 or height <= 0:
+        return
+
+    # Skip rectangles that are completely out of the image
+    canvas_height, canvas_width = canvas.shape[:2]
+    is_visible = (xs < canvas_width) & (ys < canvas_height) & (xs + width > 0) & (ys + height > 0)
+    xs, ys = xs[is_visible], ys[is_visible]
+
+    # Indices of all pixels of all rectangles.
+    # Partially visible rectangles are clipped to the edge pixels they cover anyway.
+    rows = np.clip(ys[:, None] + np.arange(height), 0, canvas_height - 1)[:, :, None]
+    cols = np.clip(xs[:, None] + np.arange(width), 0, canvas_width - 1)[:, None, :]
+
+    if rgba[3] == 255:
+        canvas[rows, cols] = rgba
+        return
+
+    # Blend over what is already on the canvas
+    source_alpha = rgba[3] / 255
+    destination = canvas[rows, cols].astype(np.float32) / 255
+    destination_alpha = destination[..., 3:] * (1 - source_alpha)
+    result_alpha = source_alpha + destination_alpha
+    result_rgb = (rgba[:3] / 255 * source_alpha + destination[..., :3] * destination_alpha) / np.maximum(result_alpha, 1e-6)
+    canvas[rows, cols] = np.rint(np.concatenate((result_rgb, result_alpha), axis=-1) * 255).astype(np.uint8)
+
+
+def paint_rectangles(canvas: NDArray, xs: NDArray, ys: NDArray, rectangle: (float, float, float, float), color: str | (str, str)):
+    """Paints the same rectangle at the given glyph positions in em, the same way as it would look in svg"""
+
+    # Round edges to whole pixels
+    x, y, width, height = rectangle
+    xs = np.rint((xs + x) * png_pixels_per_em).astype(np.int64)
+    ys = np.rint((ys + y) * png_pixels_per_em).astype(np.int64)
+    width = round(width * png_pixels_per_em)
+    height = round(height * png_pixels_per_em)
+
+    if isinstance(color, str):
+        fill_pixel_rectangles(canvas, xs, ys, width, height, color)
+        return
+
+    # The outline is fully inside the rectangle and is drawn over the fill,
+    # so the outline is 4 strips along the edges and the fill is what is left inside
+    fill_color, outline_color = color
+    outline = min(round(outline_size * png_pixels_per_em), width // 2, height // 2)
+    fill_pixel_rectangles(canvas, xs, ys, width, outline, outline_color)
+    fill_pixel_rectangles(canvas, xs, ys + height - outline, width, outline, outline_color)
+    fill_pixel_rectangles(canvas, xs, ys + outline, outline, height - 2 * outline, outline_color)
+    fill_pixel_rectangles(canvas, xs + width - outline, ys + outline, outline, height - 2 * outline, outline_color)
+    fill_pixel_rectangles(canvas, xs + outline, ys + outline, width - 2 * outline, height - 2 * outline, fill_color)
+
+
+def write_png(output: BinaryIO, pixels: NDArray):
+    """Writes RGBA pixels (height by width by 4 array of bytes) as png"""
+
+    height, width = pixels.shape[:2]
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    # Each row starts with filter type 0 (none)
+    scanlines = np.zeros((height, 1 + width * 4), dtype=np.uint8)
+    scanlines[:, 1:] = pixels.reshape((height, width * 4))
+
+    output.write(b"\x89PNG\r\n\x1a\n")
+    output.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))  # 8 bit RGBA
+    output.write(chunk(b"IDAT", zlib.compress(scanlines.tobytes())))
+    output.write(chunk(b"IEND", b""))
+
+
+def render_png(text_lines: Iterable[str], output: BinaryIO, is_verbose: bool = True):
+    """Renders png image into the output. Verbose rendering prints progress and layout problems."""
+
+    layout_diagnostics.reset()
+
+    # Collect glyph positions grouped by their block position and colors,
+    # so that all glyphs of a group are painted at once
+    glyph_positions: dict[(int, (str | (str, str), str | (str, str))), (list[float], list[float])] = dict()
+    line_count = 0
 
     for line_index, line in enumerate(text_lines):
+        line_count += 1
+        for col_index, color_pair in layout_line(line):
+            x, y = find_glyph_position(line_index, col_index)
+            xs, ys = glyph_positions.setdefault((col_index % 4, color_pair), (list(), list()))
+            xs.append(x)
+            ys.append(y)
+
+    if is_verbose:
+        layout_diagnostics.report()
+
+    # Paint. Png images must be at least 1 pixel wide and high, which empty text or small pixels per em are not.
+    canvas_width = max(round(image_width * glyph_size * png_pixels_per_em), 1)
+    canvas_height = max(round(find_image_height(line_count) * png_pixels_per_em), 1)
+    canvas = np.empty((canvas_height, canvas_width, 4), dtype=np.uint8)
+    canvas[:, :] = parse_color(png_background_color)
+
+    for (position_within_block, (top_color, bottom_color)), (xs, ys) in glyph_positions.items():
+        _, _, top, bottom = glyph_geometry[position_within_block]
+        xs, ys = np.array(xs), np.array(ys)
+        paint_rectangles(canvas, xs, ys, top, top_color)
+        paint_rectangles(canvas, xs, ys, bottom, bottom_color)
+
+    # Write to output
+    if is_verbose:
+        print("Writing output...")
+    write_png(output, canvas)
 
-        col_index = 0
-        for character in line.upper():
-            
-            # Find colors
-            color_pair = alphabet.get(character, None)
 
-            if use_extended_alphabet and color_pair is None:
-                color_pair = alphabet_extension.get(character, None)
+# ======== RENDERING ======== #
+output_types: Final[tuple[str, ...]] = ("svg", "png")
 
-            if color_pair is None:
-                print(f"Character {repr(character)} at wrapped row {line_index+1} col {col_index+1} is not defined in the alphabet. Skipping.")
-                
-                if keep_unknown_characters:
-                    color_pair = glyph_unknown
+
+def render_file(input_file_path: Path, output_file_path: Path):
+    with input_file_path.open() as input_stream:
+
+        text_lines = split_text_lines(input_stream)
+
+        if output_type == "png":
+            with output_file_path.open("wb") as output:
+                render_png(text_lines, output)
+            return
+
+        line_cache_file_path = output_file_path.with_name(output_file_path.name + ".line_cache") if incremental_rendering else None
+        with output_file_path.open("w") as output:
+            render_svg(text_lines, output, line_cache_file_path)
+
+
+def find_settings_problem(settings: dict[str, Any]) -> str | None:
+    """Checks the settings that rendering depends on. Returns the description of the first problem or None."""
+
+    width = settings["image_width"]
+    if not isinstance(width, int) or width < 1:
+        return f"Image width must be an integer of at least 1 characters, not {width!r}"
+
+    if settings["output_type"] not in output_types:
+        return f"Unknown output type \"{settings['output_type']}\""
+
+    pixels_per_em = settings["png_pixels_per_em"]
+    if not isinstance(pixels_per_em, (int, float)) or pixels_per_em <= 0:
+        return f"Png pixels per em must be a positive number, not {pixels_per_em!r}"
+
+    return None
+
+
+# Settings can only be changed by one render at a time
+settings_lock: Final = Lock()
+# Tables built for overridden settings, by the hash of all settings with the overrides, from least to most recently used
+overridden_tables: Final[OrderedDict[str, dict[str, Any]]] = OrderedDict()
+# Names of the settings that can be overridden in the library api and the render service
+overridable_settings: Final[tuple[str, ...]] = (
+    "glyph_size", "image_width", "line_separation_height", "outline_size",
+    "keep_unknown_characters", "use_extended_alphabet", "spaces_become_line_breaks", "inline_line_breaks",
+    "compact_output", "coordinate_precision", "output_type", "png_pixels_per_em", "png_background_color",
+    "color_palette", "alphabet", "alphabet_extension", "glyph_unknown"
+)
+table_names: Final[tuple[str, ...]] = (
+    "glyph_geometry", "glyph_colors", "glyph_unknown_colors", "glyph_color_pairs", "glyph_color_numbers",
+    "line_separation_in_widths"
+)
+
+
+@contextmanager
+def overridden_settings(options: dict[str, Any]):
+    """
+    Overrides settings by name and switches to tables built for them, restoring everything on exit.
+    Tables for the recently used sets of overrides are built once and kept.
+    """
+
+    for name in options:
+        if name not in overridable_settings:
+            raise ValueError(f"Unknown or not overridable setting \"{name}\"")
+
+    module_globals = globals()
+
+    # Invalid settings can make rendering never finish, so they are checked before being applied
+    problem = find_settings_problem({**module_globals, **options})
+    if problem is not None:
+        raise ValueError(problem)
+
+    previous = {name: module_globals[name] for name in (*options, *table_names)}
+
+    try:
+        module_globals.update(options)
+
+        if len(options) > 0:
+            # Keyed by all settings, so that tables are built again after other settings are changed
+            options_key = hash_settings()
+            tables = overridden_tables.get(options_key, None)
+            if tables is None:
+                build_tables()
+                tables = {name: module_globals[name] for name in table_names}
+                overridden_tables[options_key] = tables
+                if len(overridden_tables) > overridden_tables_size:
+                    overridden_tables.popitem(last=False)
+            else:
+                overridden_tables.move_to_end(options_key)
+            module_globals.update(tables)
+
+        yield
+
+    finally:
+        module_globals.update(previous)
+
+
+def render(text: str, options: dict[str, Any] | None = None) -> str | bytes:
+    """
+    Renders text into an svg string or png bytes, depending on the output type.
+    Options override settings by name, e.g. {"image_width": 16, "output_type": "png"}.
+    Renders one at a time, as settings are shared: concurrent calls wait for each other. Nothing is printed,
+    layout problems of the render are in layout diagnostics until the next render.
+    """
+
+    with settings_lock, overridden_settings(options or dict()):
+
+        text_lines = split_text_lines((text,))
+
+        if output_type == "png":
+            binary_output = BytesIO()
+            render_png(text_lines, binary_output, is_verbose=False)
+            return binary_output.getvalue()
+
+        text_output = StringIO()
+        render_svg(text_lines, text_output, is_verbose=False)
+        return text_output.getvalue()
+
+
+# ======== RENDER SERVICE ======== #
+class RenderMetrics:
+    """
+    Thread safe metrics of the render service.
+    Latencies are of successful renders only and include waiting for other renders.
+    The request rate is over the whole uptime, including failed requests and idle time.
+    """
+
+    start_time: float
+    render_count: int
+    error_count: int
+    total_seconds: float
+    recent_seconds: deque[float]
+    lock: Lock
+
+    def __init__(self):
+        super().__init__()
+        self.start_time = perf_counter()
+        self.render_count = 0
+        self.error_count = 0
+        self.total_seconds = 0
+        self.recent_seconds = deque(maxlen=1000)
+        self.lock = Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.render_count += 1
+            self.total_seconds += seconds
+            self.recent_seconds.append(seconds)
+
+    def add_error(self):
+        with self.lock:
+            self.error_count += 1
+
+    def as_dict(self) -> dict[str, Any]:
+        with self.lock:
+            uptime = perf_counter() - self.start_time
+            render_count = self.render_count
+            error_count = self.error_count
+            total_seconds = self.total_seconds
+            recent = sorted(self.recent_seconds)
+
+        def percentile_ms(fraction: float) -> float | None:
+            return recent[min(int(len(recent) * fraction), len(recent) - 1)] * 1000 if len(recent) > 0 else None
+
+        return {
+            "renders": render_count,
+            "errors": error_count,
+            "uptime_seconds": uptime,
+            "requests_per_second": (render_count + error_count) / uptime if uptime > 0 else 0,
+            "mean_latency_ms": total_seconds / render_count * 1000 if render_count > 0 else None,
+            "p50_latency_ms": percentile_ms(0.5),
+            "p95_latency_ms": percentile_ms(0.95),
+            "max_latency_ms": recent[-1] * 1000 if len(recent) > 0 else None,
+        }
+
+
+def timed_render(metrics: RenderMetrics, request: dict[str, Any]) -> (str | bytes, float):
+    """Renders a request with "text" and optional "options", recording it in metrics. Returns the image and seconds taken."""
+
+    start = perf_counter()
+    try:
+        image = render(request["text"], request.get("options", None))
+    except Exception:
+        metrics.add_error()
+        raise
+
+    seconds = perf_counter() - start
+    metrics.add(seconds)
+    return (image, seconds)
+
+
+def serve_http():
+    """
+    Serves renders over http:
+    POST /render with json {"text": ..., "options": {...}} responds with the image,
+    GET /metrics responds with json metrics.
+    Requests are handled concurrently, but renders run one at a time (see render).
+    """
+
+    metrics = RenderMetrics()
+
+    class RenderRequestHandler(BaseHTTPRequestHandler):
+
+        def send_body(self, status: int, content_type: str, body: bytes, headers: dict[str, str] | None = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or dict()).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_body(404, "text/plain", b"Not found")
+                return
+            self.send_body(200, "application/json", json.dumps(metrics.as_dict()).encode())
+
+        def do_POST(self):
+            if self.path != "/render":
+                self.send_body(404, "text/plain", b"Not found")
+                return
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                image, seconds = timed_render(metrics, request)
+            except Exception as exception:
+                self.send_body(400, "text/plain", str(exception).encode())
+                return
+
+            headers = {"X-Render-Milliseconds": f"{seconds * 1000:.3f}"}
+            if isinstance(image, bytes):
+                self.send_body(200, "image/png", image, headers)
+            else:
+                self.send_body(200, "image/svg+xml", image.encode(), headers)
+
+    with ThreadingHTTPServer(server_address, RenderRequestHandler) as server:
+        print(f"Serving renders on http://{server_address[0]}:{server_address[1]}/render ...")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    print(json.dumps(metrics.as_dict(), indent=2))
+
+
+def serve_stdin():
+    """
+    Serves renders over standard input and output, one json request per line:
+    {"id": ..., "text": ..., "options": {...}} responds with {"id": ..., "svg" or "png" (base64): ..., "ms": ...}.
+    Request {"metrics": true} responds with metrics. All other messages are written to standard error.
+    """
+
+    metrics = RenderMetrics()
+    responses = sys.stdout
+
+    with redirect_stdout(sys.stderr):
+        for request_line in sys.stdin:
+
+            if request_line.strip() == "":
+                continue
+
+            response: dict[str, Any] = dict()
+            try:
+                request = json.loads(request_line)
+                response["id"] = request.get("id", None)
+
+                if request.get("metrics", False):
+                    response["metrics"] = metrics.as_dict()
                 else:
-                    continue
+                    image, seconds = timed_render(metrics, request)
+                    if isinstance(image, bytes):
+                        response["png"] = b64encode(image).decode()
+                    else:
+                        response["svg"] = image
+                    response["ms"] = seconds * 1000
 
-            # Create and add the rectangle
-            top_color = color_palette[color_pair[0]]
-            bottom_color = color_palette[color_pair[1]]
-            rectangles.extend(generate_rectangle_pair(line_index, col_index, top_color, bottom_color))
+            except Exception as exception:
+                response["error"] = str(exception)
 
-            # Move to the next column in the resulting image
-            col_index += 1
+            responses.write(json.dumps(response))
+            responses.write("\n")
+            responses.flush()
 
-    # Create the image
-    image_height: float = len(text_lines) * (2 * glyph_size)
+        print(json.dumps(metrics.as_dict(), indent=2))
 
-    if not use_extended_alphabet or not inline_line_breaks:
-        image_height += len(text_lines) * line_separation_height
 
-    image = svg_template.format(
-        width=image_width*glyph_size,
-        height=image_height,
-        content="\n".join(rectangles)
-    )
+# ======== BATCH RENDERING ======== #
+def find_batch_input_files() -> list[Path]:
+    batch_input_path = Path(batch_input)
+    if batch_input_path.is_dir():
+        return sorted(batch_input_path.glob("*.txt"))
+    # Outputs and line caches written next to the inputs must not become inputs of the next run
+    return sorted(path for path in map(Path, glob(batch_input, recursive=True)) if path.suffix == ".txt" and path.is_file())
+
+
+# Names of all settings that affect the resulting images
+image_settings: Final[tuple[str, ...]] = (
+    "glyph_size", "image_width", "line_separation_height", "outline_size",
+    "keep_unknown_characters", "use_extended_alphabet", "spaces_become_line_breaks", "inline_line_breaks",
+    "compact_output", "coordinate_precision", "output_type", "png_pixels_per_em", "png_background_color",
+    "color_palette", "alphabet", "alphabet_extension", "glyph_unknown",
+    "svg_template", "rect_template", "rect_outline_template",
+    "glyph_definitions_template", "glyph_definition_template", "glyph_use_template",
+    "rectangle_height_in_widths", "rectangle_same_glyph_distance_in_widths"
+)
+
+
+def hash_settings() -> str:
+    """Hash of all settings that affect the resulting images"""
+    settings = tuple(globals()[name] for name in image_settings)
+    return sha256(repr(settings).encode()).hexdigest()
 
-    # Write to file
-    print("Writing output...")
-    output_file_path = Path(output_file.format(name=input_file_path.stem))
-    bytes_written = output_file_path.write_text(image)
-    print(f"{bytes_written} bytes written to \"{output_file_path}\"")
+
+def hash_input_file(input_file_path: Path, settings_hash: str) -> str:
+    """Hash of the input file contents combined with the settings hash"""
+
+    digest = sha256(settings_hash.encode())
+    with input_file_path.open("rb") as input_stream:
+        while chunk := input_stream.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_batch() -> bool:
+    """Renders all batch input files that changed. Returns wether all of them were rendered."""
+
+    # The batch helpers are in the imports directory next to this script's directory
+    imports_directory = str(Path(__file__).resolve().parent.parent / "imports")
+    if imports_directory not in sys.path:
+        sys.path.append(imports_directory)
+    from batch_processing import read_cache, write_cache, process_in_workers
+
+    input_file_paths = find_batch_input_files()
+    print(f"Found {len(input_file_paths)} input files...")
+
+    # Find inputs that need rendering
+    cache: dict[str, str] = read_cache(render_cache_file)
+    settings_hash = hash_settings()
+    jobs: list[(Path, Path, str, str)] = list()  # input, output, cache key, hash
+
+    for input_file_path in input_file_paths:
+        output_file_path = input_file_path.parent / output_file.format(name=input_file_path.stem, extension=output_type)
+        cache_key = str(input_file_path.resolve())
+        input_hash = hash_input_file(input_file_path, settings_hash)
+
+        if cache.get(cache_key, None) == input_hash and output_file_path.exists():
+            continue
+
+        jobs.append((input_file_path, output_file_path, cache_key, input_hash))
+
+    print(f"Skipping {len(input_file_paths) - len(jobs)} unchanged input files...")
+
+    # Render in parallel
+    print(f"Rendering {len(jobs)} input files...")
+    settings = {name: globals()[name] for name in (*image_settings, "incremental_rendering")}
+    failed_count = process_in_workers(render_file, jobs, cache, settings, batch_workers)
+    write_cache(render_cache_file, cache)
+
+    print(f"{len(jobs) - failed_count} files rendered, {failed_count} failed.")
+    return failed_count == 0
+
+
+def main() -> int:
+    """Returns the exit status, which is 1 if the script has failed."""
+
+    # Check some settings
+    problem = find_settings_problem(globals())
+    if problem is not None:
+        print(f"{problem}. Aborting.")
+        return 1
+
+    # Serve renders
+    if serve_mode == "http":
+        serve_http()
+        return 0
+    if serve_mode == "stdin":
+        serve_stdin()
+        return 0
+
+    # Render many files
+    if batch_input is not None:
+        return 0 if render_batch() else 1
+    
+    # Check input file
+    input_file_path = Path(input_file)
+    if not (input_file_path.exists() and input_file_path.is_file()):
+        print(f"File \"{input_file}\" does not exist or is not a file.")
+        return 1
+
+    # Generate image
+    print("Generating image...")
+    output_file_path = Path(output_file.format(name=input_file_path.stem, extension=output_type))
+    render_file(input_file_path, output_file_path)
+
+    print(f"{output_file_path.stat().st_size} bytes written to \"{output_file_path}\"")
+    return 0
 
 
 if __name__ == "__main__":
+    exit_status = 1
     try:
-        main()
-        input("Press enter to exit")
+        exit_status = main()
     except Exception:
         print("An error has occurred:")
         print(format_exc())
+    # Services run until their input ends or they are interrupted, with nobody to press enter
+    if pause_on_exit and serve_mode is None:
         input("Press enter to exit")
+    sys.exit(exit_status)
@@ -1,8 +1,12 @@
 from __future__ import annotations
-from typing import Final
+from typing import Final, Any, Callable, Iterable
 
+import sys
 import json
+from glob import glob
+from functools import reduce
 from datetime import date
+from hashlib import sha256
 from pathlib import Path
 from traceback import format_exc
 
@@ -27,6 +31,8 @@ no_modded_modules_filter_location: Final[str] = "../_No Modded Modules.json"
 output_name_location_format: Final[str] = "ManualRepoFilter - {date}.json"
 # Format of the date used for {date} above
 date_format: Final[str] = "%d-%b-%Y"
+# Wether to write indented json (True) or compact json (False)
+pretty_json: Final[bool] = True
 # List of vanilla modules (appended to the filter regardless of no modded profile)
 vanilla_modules: Final[list[str]] = [
     "BigButton",
@@ -42,41 +48,266 @@ vanilla_modules: Final[list[str]] = [
     "WireSequence"
 ]
 
+# Directory with many no modded modules profiles (*.json) to convert all at once instead of the one above, or None
+batch_profiles_directory: Final[str | None] = None
+# Directory to write filters made in batch into
+batch_output_directory: Final[str] = "filters"
+# Format of the output file names in batch. Supports {name} for profile name without extension and {date} for current date
+batch_output_name_format: Final[str] = "{name} - ManualRepoFilter - {date}.json"
+# Number of processes converting profiles in parallel, or None for one per processor
+batch_workers: Final[int | None] = None
+# File to remember converted profiles in, so that only profiles that changed
+# along with the settings since the last run are converted, or None to always convert everything
+batch_cache_file: Final[str | None] = "ktane_filter_cache.json"
 
-def main():
-    
-    no_modded_path = Path(no_modded_modules_filter_location)
-    if not (no_modded_path.exists() and no_modded_path.is_file()):
-        print(f"File \"{no_modded_modules_filter_location}\" does not exist or is not a file.")
-        return
+# Expression over module sets of profiles to compute instead of the conversion above, or None.
+# A profile is (path, list name), where the list is "DisabledList" or "EnabledList" and the path can be a glob
+# that adds all matching profiles as operands. An operation is ("union" | "intersection" | "difference", operand, ...),
+# where difference takes the modules of the first operand that are in none of the others.
+# Example: all modules enabled by any expert in the "experts" directory that are not disabled by the defuser:
+#   ("difference", ("union", ("experts/*.json", "EnabledList")), ("defuser.json", "DisabledList"))
+profile_expression: Final[tuple | None] = None
+# Format of the file to write the resulting profile into. Supports {date} for current date
+profile_expression_output_format: Final[str] = "Combined Profile - {date}.json"
+# The list to put the resulting modules into and the operation of the resulting profile
+profile_expression_result_list: Final[str] = "EnabledList"
+profile_expression_operation: Final[int] = 0
 
-    print("Reading no modded modules profile...")
-    no_modded_profile = json.loads(no_modded_path.read_text())
 
-    print("Forming a filter profile...")
-    module_list = list(no_modded_profile["DisabledList"])
-    module_list.extend(vanilla_modules)
+# ======== CONVERSION ======== #
+def make_filter_profile(no_modded_profile: dict[str, Any]) -> dict[str, Any]:
+    """Forms a filter profile with all modules disabled in the no modded profile and all vanilla modules, sorted"""
 
-    filter_profile = {
+    module_set = set(no_modded_profile["DisabledList"])
+    module_set.update(vanilla_modules)
+
+    return {
         "DisabledList": [],
-        "EnabledList": module_list,
+        "EnabledList": sorted(module_set),
         "Operation": 0
     }
-    filter_profile_string = json.dumps(filter_profile, indent=2)
+
+
+def dump_profile(profile: dict[str, Any]) -> str:
+    if pretty_json:
+        return json.dumps(profile, indent=2)
+    return json.dumps(profile, separators=(",", ":"))
+
+
+def convert_profile(no_modded_path: Path, output_path: Path) -> int:
+    """Converts a no modded modules profile file into a filter profile file. Returns the number of bytes written."""
+    filter_profile = make_filter_profile(json.loads(no_modded_path.read_text()))
+    return output_path.write_text(dump_profile(filter_profile))
+
+
+# Settings that conversion depends on, which are given to the worker processes
+conversion_settings: Final[tuple[str, ...]] = ("pretty_json", "vanilla_modules")
+
+
+def hash_profile(no_modded_path: Path) -> str:
+    """Hash of the profile file combined with the settings that affect the filter and where it is written"""
+    digest = sha256(repr((pretty_json, vanilla_modules, batch_output_directory, batch_output_name_format)).encode())
+    digest.update(no_modded_path.read_bytes())
+    return digest.hexdigest()
+
+
+def convert_batch() -> bool:
+    """Converts all profiles that changed. Returns wether all of them were converted."""
+
+    # The batch helpers are in the imports directory next to this script's directory
+    imports_directory = str(Path(__file__).resolve().parent.parent / "imports")
+    if imports_directory not in sys.path:
+        sys.path.append(imports_directory)
+    from batch_processing import read_cache, write_cache, process_in_workers
+
+    profiles_path = Path(batch_profiles_directory)
+    if not profiles_path.is_dir():
+        print(f"Directory \"{batch_profiles_directory}\" does not exist or is not a directory.")
+        return False
+
+    no_modded_paths = sorted(profiles_path.glob("*.json"))
+    print(f"Found {len(no_modded_paths)} profiles...")
+
+    # Find profiles that need converting.
+    # The cache has the path of a profile to its hash and the output path.
+    cache: dict[str, (str, str)] = read_cache(batch_cache_file)
+    output_directory_path = Path(batch_output_directory)
+    output_directory_path.mkdir(parents=True, exist_ok=True)
+    current_date_string = date.today().strftime(date_format)
+    jobs: list[(Path, Path, str, (str, str))] = list()  # profile, output, cache key, (hash, output)
+
+    for no_modded_path in no_modded_paths:
+        cache_key = str(no_modded_path.resolve())
+        profile_hash = hash_profile(no_modded_path)
+
+        cached = cache.get(cache_key, None)
+        if cached is not None and cached[0] == profile_hash and Path(cached[1]).exists():
+            continue
+
+        output_path = output_directory_path / batch_output_name_format.format(name=no_modded_path.stem, date=current_date_string)
+        jobs.append((no_modded_path, output_path, cache_key, (profile_hash, str(output_path))))
+
+    print(f"Skipping {len(no_modded_paths) - len(jobs)} unchanged profiles...")
+
+    # Convert in parallel
+    print(f"Converting {len(jobs)} profiles...")
+    settings = {name: globals()[name] for name in conversion_settings}
+    failed_count = process_in_workers(convert_profile, jobs, cache, settings, batch_workers)
+    write_cache(batch_cache_file, cache)
+
+    print(f"{len(jobs) - failed_count} profiles converted, {failed_count} failed.")
+    return failed_count == 0
+
+
+# ======== PROFILE SET ALGEBRA ======== #
+class ModuleIndex:
+    """
+    Interns module ids into bit positions, so that sets of modules are integer bitsets
+    and set operations on whole profiles are single integer operations.
+    """
+
+    module_ids: list[str]
+    positions: dict[str, int]
+
+    def __init__(self):
+        super().__init__()
+        self.module_ids = list()
+        self.positions = dict()
+
+    def to_bits(self, module_ids: Iterable[str]) -> int:
+
+        positions = list()
+        for module_id in module_ids:
+            position = self.positions.get(module_id, None)
+            if position is None:
+                position = len(self.module_ids)
+                self.positions[module_id] = position
+                self.module_ids.append(module_id)
+            positions.append(position)
+
+        # Set bits in a byte array first, so that building the integer is linear
+        flags = bytearray((len(self.module_ids) + 7) // 8)
+        for position in positions:
+            flags[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(flags, "little")
+
+    def to_module_ids(self, bits: int) -> list[str]:
+        """Module ids of the set bits, sorted"""
+        binary_digits = bin(bits)[:1:-1]  # Lowest bit first
+        return sorted(self.module_ids[position] for position, digit in enumerate(binary_digits) if digit == "1")
+
+
+profile_operations: Final[dict[str, Callable[[int, int], int]]] = {
+    "union": lambda a, b: a | b,
+    "intersection": lambda a, b: a & b,
+    "difference": lambda a, b: a & ~b,
+}
+
+
+def evaluate_profile_expression(
+        expression: tuple,
+        index: ModuleIndex,
+        profiles: dict[str, dict[str, Any]],
+        profile_bits: dict[(str, str), int]
+    ) -> list[int]:
+    """
+    Evaluates an expression into module bitsets.
+    A profile with a glob path evaluates into a bitset per matching profile, everything else into one bitset.
+    Profile files are read once and kept in profiles by path, their lists are kept in profile bits by (path, list name).
+    """
+
+    name = expression[0]
+
+    # Operation
+    if name in profile_operations:
+        operands = [bits for operand in expression[1:] for bits in evaluate_profile_expression(operand, index, profiles, profile_bits)]
+        if len(operands) == 0:
+            raise ValueError(f"Operation \"{name}\" has no operands")
+        return [reduce(profile_operations[name], operands)]
+
+    # Profiles. Paths without glob special characters are used as they are, so that a missing profile is an error.
+    if len(expression) != 2 or not isinstance(expression[1], str):
+        raise ValueError(f"Unknown operation \"{name}\". Must be one of: {', '.join(profile_operations)}")
+    path_pattern, list_name = expression
+    is_glob = any(character in path_pattern for character in "*?[")
+    paths = sorted(glob(path_pattern)) if is_glob else [path_pattern]
+    if len(paths) == 0:
+        raise ValueError(f"No profiles match \"{path_pattern}\"")
+
+    results = list()
+    for path in paths:
+        resolved_path = str(Path(path).resolve())
+        bits = profile_bits.get((resolved_path, list_name), None)
+        if bits is None:
+            profile = profiles.get(resolved_path, None)
+            if profile is None:
+                profile = json.loads(Path(path).read_text())
+                profiles[resolved_path] = profile
+            bits = index.to_bits(profile[list_name])
+            profile_bits[(resolved_path, list_name)] = bits
+        results.append(bits)
+
+    return results
+
+
+def combine_profiles():
+
+    print("Reading profiles and combining modules...")
+    index = ModuleIndex()
+    profiles: dict[str, dict[str, Any]] = dict()
+    profile_bits: dict[(str, str), int] = dict()
+    result_bits = reduce(profile_operations["union"], evaluate_profile_expression(profile_expression, index, profiles, profile_bits))
+    module_list = index.to_module_ids(result_bits)
+    print(f"{len(profiles)} profiles with {len(index.module_ids)} distinct modules combined into {len(module_list)} modules...")
+
+    profile = {
+        "DisabledList": [],
+        "EnabledList": [],
+        "Operation": profile_expression_operation
+    }
+    profile[profile_expression_result_list] = module_list
 
     # Write final file
     print("Writing to output file...")
     current_date_string = date.today().strftime(date_format)
+    output_path = Path(profile_expression_output_format.format(date=current_date_string))
+    bytes_written = output_path.write_text(dump_profile(profile))
+    print(f"{bytes_written} bytes written.")
+
+
+def main() -> int:
+    """Returns the exit status, which is 1 if the script has failed."""
+
+    # Combine profiles
+    if profile_expression is not None:
+        combine_profiles()
+        return 0
+
+    # Convert many profiles
+    if batch_profiles_directory is not None:
+        return 0 if convert_batch() else 1
+    
+    no_modded_path = Path(no_modded_modules_filter_location)
+    if not (no_modded_path.exists() and no_modded_path.is_file()):
+        print(f"File \"{no_modded_modules_filter_location}\" does not exist or is not a file.")
+        return 1
+
+    # Write final file
+    print("Converting no modded modules profile to a filter profile...")
+    current_date_string = date.today().strftime(date_format)
     output_path = Path(output_name_location_format.format(date=current_date_string))
-    bytes_written = output_path.write_text(filter_profile_string)
+    bytes_written = convert_profile(no_modded_path, output_path)
     print(f"{bytes_written} bytes written.")
+    return 0
 
 
 if __name__ == "__main__":
+    exit_status = 1
     try:
-        main()
+        exit_status = main()
         input("Press enter to exit")
     except Exception:
         print("An error has occurred:")
         print(format_exc())
         input("Press enter to exit")
+    sys.exit(exit_status)
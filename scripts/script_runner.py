@@ -0,0 +1,241 @@
+from __future__ import annotations
+from typing import Final, Any, Callable
+
+import os
+import sys
+import json
+import platform
+import tracemalloc
+from io import StringIO
+from time import perf_counter, process_time
+from pstats import Stats
+from cProfile import Profile
+from pathlib import Path
+from datetime import datetime
+from importlib import import_module
+from contextlib import redirect_stdout, nullcontext
+from traceback import format_exc
+
+
+# == PROBLEM ==
+# Run any of the scripts in this directory without waiting for input,
+# with settings overridden from a config file,
+# and measure how long importing and running it takes and how much memory it uses.
+#
+# The config file is json with settings to override by name, for example:
+#   { "sequence_length": 100000, "output_file_type": "npy", "print_to_console": false }
+#
+# The script name and the config file can also be given as command line arguments:
+#   python script_runner.py sequence_generator config.json
+#
+# The report is json with the wall and processor time and peak memory of each phase
+# (import, configure, main) and the functions that took the most time in main.
+# A script has failed if main raises or returns an exit status other than 0.
+#
+# Times are measured in a run without any instrumentation. Memory and the functions are measured
+# in separate runs after it, as tracing memory and profiling make the script run several times slower.
+# Caches that let a script skip work done by a previous run are turned off in all runs,
+# so that every number is of the whole work instead of a run that has nothing left to do.
+
+
+# ======== SETTINGS ======== #
+# Name of the script to run, without extension
+script_name: Final[str] = "sequence_generator"
+# Path to json file with settings of the script to override, or None to run with the script's own settings
+config_file: Final[str | None] = None
+# Filename to write the report into or None for console only.
+# Supports {script} for the script name.
+report_file: Final[str | None] = "{script}.report.json"
+
+# Wether to hide everything the script prints
+quiet: Final[bool] = True
+# Wether to measure peak memory of each phase, in a separate run of the script.
+# Only memory of the runner's process is traced, not of worker processes.
+trace_memory: Final[bool] = True
+# Number of functions that took the most time in main to report, in a separate run of the script,
+# or 0 to not profile main
+profile_top_functions: Final[int] = 15
+
+# Settings of scripts' caches and their values that turn the caches off.
+# Only the settings a script has are applied.
+cache_off_settings: Final[dict[str, Any]] = {
+    "render_cache_file": None,
+    "incremental_rendering": False,
+    "batch_cache_file": None,
+}
+
+# Scripts that can be run
+runnable_scripts: Final[tuple[str, ...]] = (
+    "durations_set_searcher",
+    "sequence_generator",
+    "color_tokki_svg_generator",
+    "ktane_repo_filter_maker",
+)
+
+
+# ======== MEASUREMENT ======== #
+def measure_phase(phases: dict[str, dict[str, Any]], name: str, action: Callable[[], Any]) -> Any:
+    """
+    Runs the action, adding its wall time and processor time to phases. Returns the action's result.
+    Processor time of child processes, such as the workers of batch modes, is counted once they have exited.
+    """
+
+    wall_start = perf_counter()
+    cpu_start = process_time()
+    child_times_start = os.times()
+    try:
+        return action()
+    finally:
+        child_times = os.times()
+        phases[name] = {
+            "wall_seconds": perf_counter() - wall_start,
+            "cpu_seconds": process_time() - cpu_start,
+            "child_cpu_seconds": (child_times.children_user + child_times.children_system) - (child_times_start.children_user + child_times_start.children_system),
+            "peak_memory_bytes": None,
+        }
+
+
+def measure_phase_memory(phases: dict[str, dict[str, Any]], name: str, action: Callable[[], Any]) -> Any:
+    """Runs the action with memory traced, adding its peak memory to phases. Returns the action's result."""
+
+    tracemalloc.reset_peak()
+    try:
+        return action()
+    finally:
+        phases[name]["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+
+
+def import_script(name: str) -> Any:
+    """Imports the script again, so that each run measures the import and starts from the script's own settings"""
+    sys.modules.pop(name, None)
+    return import_module(name)
+
+
+def override_settings(script: Any, settings: dict[str, Any]):
+
+    for name, value in settings.items():
+        if not hasattr(script, name) or callable(getattr(script, name)):
+            raise ValueError(f"Script \"{script.__name__}\" has no setting \"{name}\"")
+        setattr(script, name, value)
+
+    # Rebuild tables that are precomputed from the settings
+    if hasattr(script, "build_tables"):
+        script.build_tables()
+
+
+def turn_caches_off(script: Any, settings: dict[str, Any]) -> dict[str, Any]:
+    """Settings with the script's caches turned off"""
+    return {**settings, **{name: value for name, value in cache_off_settings.items() if hasattr(script, name)}}
+
+
+def list_top_functions(profile: Profile) -> list[dict[str, Any]]:
+
+    stats = Stats(profile)
+    functions = list()
+
+    for (file_name, line, function_name), (_, call_count, own_seconds, cumulative_seconds, _) in stats.stats.items():
+        functions.append({
+            "function": f"{Path(file_name).name}:{line}({function_name})",
+            "calls": call_count,
+            "own_seconds": own_seconds,
+            "cumulative_seconds": cumulative_seconds,
+        })
+
+    functions.sort(key=lambda function: function["own_seconds"], reverse=True)
+    return functions[:profile_top_functions]
+
+
+def main() -> int:
+    """Runs the script and writes the report. Returns the exit status, which is 1 if the script has failed."""
+
+    # Command line arguments take priority over settings
+    name = sys.argv[1] if len(sys.argv) > 1 else script_name
+    config_path = sys.argv[2] if len(sys.argv) > 2 else config_file
+
+    if name not in runnable_scripts:
+        print(f"Unknown script \"{name}\". Must be one of: {', '.join(runnable_scripts)}. Aborting.")
+        return 1
+
+    settings: dict[str, Any] = dict()
+    if config_path is not None:
+        settings = json.loads(Path(config_path).read_text())
+
+    # Scripts are imported from the same directory as the runner
+    scripts_directory = str(Path(__file__).resolve().parent)
+    if scripts_directory not in sys.path:
+        sys.path.insert(0, scripts_directory)
+
+    report: dict[str, Any] = {
+        "script": name,
+        "settings": settings,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "phases": dict(),
+        "error": None,
+    }
+    phases = report["phases"]
+    script_output = StringIO()
+
+    # Timing run, without instrumentation
+    print(f"Running {name}...")
+    try:
+        with redirect_stdout(script_output) if quiet else nullcontext():
+            script = measure_phase(phases, "import", lambda: import_script(name))
+            run_settings = turn_caches_off(script, settings)
+            measure_phase(phases, "configure", lambda: override_settings(script, run_settings))
+            status = measure_phase(phases, "main", script.main)
+
+        # Scripts report failures they handle themselves with the exit status
+        if status not in (None, 0):
+            output_lines = script_output.getvalue().strip().splitlines()
+            report["error"] = f"Script has failed with exit status {status}" + (f": {output_lines[-1]}" if len(output_lines) > 0 else "")
+
+        # Memory run
+        if trace_memory and report["error"] is None:
+            print(f"Running {name} again to measure memory...")
+            tracemalloc.start()
+            try:
+                with redirect_stdout(StringIO()) if quiet else nullcontext():
+                    script = measure_phase_memory(phases, "import", lambda: import_script(name))
+                    measure_phase_memory(phases, "configure", lambda: override_settings(script, run_settings))
+                    measure_phase_memory(phases, "main", script.main)
+            finally:
+                tracemalloc.stop()
+
+        # Profiling run
+        if profile_top_functions > 0 and report["error"] is None:
+            print(f"Running {name} again to profile...")
+            profile = Profile()
+            with redirect_stdout(StringIO()) if quiet else nullcontext():
+                script = import_script(name)
+                override_settings(script, run_settings)
+                profile.runcall(script.main)
+            report["top_functions"] = list_top_functions(profile)
+
+    except Exception:
+        report["error"] = format_exc()
+
+    # Output of the timing run
+    report["output_lines"] = script_output.getvalue().count("\n")
+
+    # Write the report
+    report_string = json.dumps(report, indent=2)
+
+    if report_file is not None:
+        report_path = Path(report_file.format(script=name))
+        bytes_written = report_path.write_text(report_string)
+        print(f"{bytes_written} bytes written to \"{report_path}\"")
+
+    print(report_string)
+
+    return 0 if report["error"] is None else 1
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except Exception:
+        print("An error has occurred:")
+        print(format_exc())
+        sys.exit(1)
@@ -1,12 +1,18 @@
 from __future__ import annotations
-from typing import Final, Iterable
+from typing import TYPE_CHECKING, Final, Iterable, Callable, Sequence
 
 import math
+import sys
 import random
 from itertools import islice
 from pathlib import Path
 from traceback import format_exc
 
+import numpy as np
+
+if TYPE_CHECKING:
+    from numpy.typing import NDArray
+
 
 # == PROBLEM ==
 # Given a list of sequence statements, generate those sequences
@@ -22,6 +28,18 @@ round_decimals: Final[int] = 6
 print_to_console: Final[bool] = True
 # Filename to print sequences to or None for no file output
 output_file: Final[str | None] = "generated_sequences.txt"
+# Type of the output file:
+# "text" -- human readable text, formatted with the settings below
+# "npy" -- numpy array with one sequence per row
+# "npz" -- numpy archive with one array per sequence and an array of their comments under "comments"
+# "csv" -- one column per sequence, named with sequence name format below
+# "matrix" -- format of MatrixSeriesWriter from imports/matrix_file_io.py, one sequence per row
+# Formats other than "text" are written directly from values and ignore the formatting settings.
+# They store float64, so integers above 2**53 lose precision in them.
+output_file_type: Final[str] = "text"
+
+# Name of a sequence in "npz" and "csv" outputs. Use {index} for sequence's index in the targets array.
+sequence_name_format: Final[str] = "seq{index}"
 
 # Format of the whole output.
 # Use {sequences} for main payload
@@ -46,71 +64,335 @@ separator_between_comment_and_sequence: Final[str] = "\n"
 
 
 # ======== SEQUENCES ======== #
+# Sequences are nodes of a lazy expression graph.
+# Nothing is computed when a sequence is declared: all targets are evaluated
+# together by `evaluate_sequences`, where each node is computed exactly once
+# with whole-array operations instead of a python generator per element.
 class SequenceInstance:
 
-    values: Iterable[float]
-    comments: Iterable[str]
-
-    def __init__(self, values: Iterable[float], *comments):
-        self.values = values
-        self.comments = comments
+    operands: tuple[SequenceInstance, ...]
+    evaluator: Callable[..., NDArray]
+    operand_length: Callable[[int], int]
+    description: str
+
+    def __init__(
+            self,
+            evaluator: Callable[..., NDArray],
+            description: str,
+            *operands: SequenceInstance,
+            operand_length: Callable[[int], int] = lambda length: length
+        ):
+        """
+        Evaluator is called with the required length and the values of each operand
+        and must return at least that many values.
+        Evaluator of a sequence without operands is called with the required length
+        and the dtype to store integer parameters as instead (see `integer_dtype`).
+        Operand length maps the required length to the number of values needed from each operand.
+        """
+        self.evaluator = evaluator
+        self.description = description
+        self.operands = operands
+        self.operand_length = operand_length
+
+    @property
+    def comments(self) -> list[str]:
+        """Comment lines describing the sequence, generated from the expression graph"""
+
+        # Modifiers are listed after the sequence they modify
+        if len(self.operands) == 1:
+            return [*self.operands[0].comments, self.description]
+
+        # Combinations list their operands below, indented
+        lines = [self.description]
+        for i, operand in enumerate(self.operands, start=1):
+            operand_comments = operand.comments
+            lines.append(f"  {i}. {operand_comments[0]}")
+            lines.extend(f"     {line}" for line in operand_comments[1:])
+        return lines
+
+    def __add__(self, other: SequenceInstance | float) -> SequenceInstance:
+        if isinstance(other, SequenceInstance):
+            return seq_sum(self, other)
+        return seq_mod_shift(self, other)
+
+    def __mul__(self, other: SequenceInstance | float) -> SequenceInstance:
+        if isinstance(other, SequenceInstance):
+            return seq_product(self, other)
+        return seq_mod_scale(self, other)
+
+    def __neg__(self) -> SequenceInstance:
+        return seq_mod_scale(self, -1)
+
+    def __sub__(self, other: SequenceInstance | float) -> SequenceInstance:
+        return self + (-other)
+
+    def __rsub__(self, other: float) -> SequenceInstance:
+        return (-self) + other
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+
+# Largest magnitude of values that are safely kept in int64.
+# Bounds are checked with float64, so this leaves room for its rounding.
+int64_bound: Final[float] = 2.0**62
+
+
+def is_too_large_integer(parameter: float) -> bool:
+    return isinstance(parameter, int) and abs(parameter) >= int64_bound
+
+
+def integer_dtype(dtype: type, *parameters: float) -> type:
+    """
+    Dtype of the values of a sequence built from the parameters:
+    the given dtype if all of them are integers, float64 otherwise.
+    Integers are stored as int64, as python integers (object) if int64 overflows
+    and as float64 if exact values are not needed.
+    Integers that do not fit in int64 to begin with are stored as python integers unless float64 is given.
+    """
+    if not all(isinstance(parameter, int) for parameter in parameters):
+        return float
+    if dtype != float and any(map(is_too_large_integer, parameters)):
+        return object
+    return dtype
+
+
+def exact_operand(values: NDArray, parameter: float) -> NDArray:
+    """Integer values as python integers if the parameter applied to them does not fit in int64"""
+    if values.dtype == np.int64 and is_too_large_integer(parameter):
+        return values.astype(object)
+    return values
+
+
+def seq_custom(generator: Callable[[], Iterable[float]], *comments: str) -> SequenceInstance:
+    """
+    Sequence from a function that returns a fresh (possibly infinite) iterable of values.
+    The iterable must have at least as many values as are needed from the sequence.
+    """
+    def evaluate(length, dtype):
+        values = np.fromiter(islice(generator(), length), dtype=float)
+        if len(values) < length:
+            raise ValueError(f"Custom sequence has {len(values)} values, but {length} are needed")
+        return values
+    return SequenceInstance(evaluate, "; ".join(comments) if len(comments) > 0 else "Custom")
 
 
 def seq_constant(value: float) -> SequenceInstance:
-    def gen():
-        while True:
-            yield value
-    return SequenceInstance(gen(), f"Constant; value {value}")
+    def evaluate(length, dtype):
+        return np.full(length, value, dtype=integer_dtype(dtype, value))
+    return SequenceInstance(evaluate, f"Constant; value {value}")
 
 
 def seq_linear(start: float, shift: float) -> SequenceInstance:
-    def gen():
-        val = start
-        while True:
-            yield val
-            val = val + shift
-    return SequenceInstance(gen(), f"Linear; start {start} shift {shift}")
+    def evaluate(length, dtype):
+        return start + shift * np.arange(length, dtype=integer_dtype(dtype, start, shift))
+    return SequenceInstance(evaluate, f"Linear; start {start} shift {shift}")
+
+
+def geometric_values(start: float, mult: float, length: int, dtype: type) -> NDArray:
+    """Values of start * mult**i of the dtype"""
+    if dtype == object:
+        # Each python integer power would be computed from scratch, multiplying the previous value is much faster
+        values = np.full(length, mult, dtype=object)
+        values[:1] = start
+        return np.multiply.accumulate(values)
+    return start * np.power(mult, np.arange(length, dtype=dtype))
 
 
 def seq_mult(start: float, mult: float) -> SequenceInstance:
-    def gen():
-        val = start
-        while True:
-            yield val
-            val = val * mult
-    return SequenceInstance(gen(), f"Multiplication; start {start}, multiplier {mult}")
+    def evaluate(length, dtype):
+        return geometric_values(start, mult, length, integer_dtype(dtype, start, mult))
+    return SequenceInstance(evaluate, f"Multiplication; start {start}, multiplier {mult}")
 
 
 def seq_power(base: float, exp_start: float = 0, exp_shift: float = 1) -> SequenceInstance:
-    def gen():
-        exp = exp_start
-        while True:
-            yield base**exp
-            exp = exp + exp_shift
-    return SequenceInstance(gen(), f"Power; base {base}, exponent start {exp_start}, exponent shift {exp_shift}")
+    def evaluate(length, dtype):
+        # Integers can not be raised to negative powers
+        if exp_start < 0 or (exp_shift < 0 and length > 1):
+            dtype = float
+        dtype = integer_dtype(dtype, base, exp_start, exp_shift)
+        if dtype == object:
+            return geometric_values(base**exp_start, base**exp_shift, length, dtype)
+        return np.power(base, exp_start + exp_shift * np.arange(length, dtype=dtype))
+    return SequenceInstance(evaluate, f"Power; base {base}, exponent start {exp_start}, exponent shift {exp_shift}")
 
 
 def seq_lucas(first: float, second: float) -> SequenceInstance:
-    def gen():
-        first_copy = first
-        second_copy = second
-        yield first_copy
-        yield second_copy
-        while True:
-            third = first_copy + second_copy
-            yield third
-            first_copy = second_copy
-            second_copy = third
-    return SequenceInstance(gen(), f"Lucas/Fibonachi; first {first}, second {second}")
+    def evaluate(length, dtype):
+        # Recurrence can not be vectorized, but it is still a single pass into a preallocated array
+        values = np.empty(max(length, 2), dtype=integer_dtype(dtype, first, second))
+        values[0] = first
+        values[1] = second
+        for i in range(2, length):
+            values[i] = values[i - 2] + values[i - 1]
+        return values
+    return SequenceInstance(evaluate, f"Lucas/Fibonachi; first {first}, second {second}")
+
+
+def seq_sum(*sequences: SequenceInstance) -> SequenceInstance:
+    def evaluate(length, *values):
+        return np.sum(values, axis=0)
+    return SequenceInstance(evaluate, f"Sum of {len(sequences)} sequences", *sequences)
+
+
+def seq_product(*sequences: SequenceInstance) -> SequenceInstance:
+    def evaluate(length, *values):
+        return np.prod(values, axis=0)
+    return SequenceInstance(evaluate, f"Product of {len(sequences)} sequences", *sequences)
+
+
+def seq_interleave(*sequences: SequenceInstance) -> SequenceInstance:
+    count = len(sequences)
+    def evaluate(length, *values):
+        result = np.empty(length, dtype=np.result_type(*values))
+        for i, sequence_values in enumerate(values):
+            target = result[i::count]
+            target[:] = sequence_values[:len(target)]
+        return result
+    return SequenceInstance(
+        evaluate,
+        f"Interleaving of {count} sequences",
+        *sequences,
+        operand_length=lambda length: math.ceil(length / count)
+    )
+
+
+def seq_mod_shift(sequence: SequenceInstance, shift: float) -> SequenceInstance:
+    def evaluate(length, values):
+        return exact_operand(values, shift) + shift
+    return SequenceInstance(evaluate, f"Shifted by {shift}", sequence)
+
+
+def seq_mod_scale(sequence: SequenceInstance, factor: float) -> SequenceInstance:
+    def evaluate(length, values):
+        return exact_operand(values, factor) * factor
+    return SequenceInstance(evaluate, f"Scaled by {factor}", sequence)
+
+
+def seq_mod_difference(sequence: SequenceInstance) -> SequenceInstance:
+    def evaluate(length, values):
+        return np.diff(values)
+    return SequenceInstance(
+        evaluate,
+        "Differences between consecutive elements",
+        sequence,
+        operand_length=lambda length: length + 1
+    )
+
+
+def seq_mod_partial_sum(sequence: SequenceInstance) -> SequenceInstance:
+    def evaluate(length, values):
+        return np.cumsum(values)
+    return SequenceInstance(evaluate, "Partial sums", sequence)
 
 
 def seq_mod_alt_sign(sequence: SequenceInstance, is_start_negative: bool = False) -> SequenceInstance:
-    def gen():
-        is_negative = is_start_negative
-        for val in sequence.values:
-            yield val * -1 if is_negative else val
-            is_negative = not is_negative
-    return SequenceInstance(gen(), *sequence.comments, f"With alternating sign; start {'negative' if is_start_negative else 'positive'}")
+    def evaluate(length, values):
+        signs = np.ones(length, dtype=values.dtype)
+        signs[int(not is_start_negative)::2] = -1
+        return values * signs
+    return SequenceInstance(evaluate, f"With alternating sign; start {'negative' if is_start_negative else 'positive'}", sequence)
+
+
+def evaluate_nodes(
+        nodes: Iterable[SequenceInstance],
+        required_lengths: dict[SequenceInstance, int],
+        leaf_dtypes: dict[SequenceInstance, type],
+        values: dict[SequenceInstance, NDArray]
+    ):
+    """Evaluates the nodes in order into values. Operands of each node must be evaluated before it."""
+
+    # int64 wraps around on overflow, which is detected after evaluation
+    with np.errstate(over="ignore", invalid="ignore"):
+        for node in nodes:
+            node_length = required_lengths[node]
+            if len(node.operands) == 0:
+                values[node] = node.evaluator(node_length, leaf_dtypes[node])[:node_length]
+                continue
+            operand_length = node.operand_length(node_length)
+            operand_values = (values[operand][:operand_length] for operand in node.operands)
+            values[node] = node.evaluator(node_length, *operand_values)[:node_length]
+
+
+def evaluate_sequences(targets: Sequence[SequenceInstance], length: int, overflow_dtype: type = object) -> list[NDArray]:
+    """
+    Evaluates all target sequences in one pass over the expression graph.
+    Every node, including ones shared between targets, is evaluated once.
+
+    Integer sequences are evaluated in int64. Sequences that do not fit in it
+    are evaluated again from python integers (object) or float64, as set by overflow dtype.
+    """
+
+    # Order nodes so that operands come before sequences that use them
+    order: list[SequenceInstance] = list()
+    visited: set[SequenceInstance] = set()
+
+    def visit(node: SequenceInstance):
+        if node in visited:
+            return
+        visited.add(node)
+        for operand in node.operands:
+            visit(operand)
+        order.append(node)
+
+    for target in targets:
+        visit(target)
+
+    # Find how many values each node has to produce
+    required_lengths: dict[SequenceInstance, int] = dict.fromkeys(order, 0)
+    for target in targets:
+        required_lengths[target] = length
+
+    for node in reversed(order):
+        operand_length = node.operand_length(required_lengths[node])
+        for operand in node.operands:
+            required_lengths[operand] = max(required_lengths[operand], operand_length)
+
+    # Evaluate
+    values: dict[SequenceInstance, NDArray] = dict()
+    evaluate_nodes(order, required_lengths, dict.fromkeys(order, np.int64), values)
+
+    # Integer nodes only have integer operands, so their bounds are found by evaluating them in float64,
+    # which does not wrap around
+    integer_nodes = [node for node in order if values[node].dtype == np.int64]
+    if len(integer_nodes) == 0:
+        return [values[target] for target in targets]
+
+    bounds: dict[SequenceInstance, NDArray] = dict()
+    evaluate_nodes(integer_nodes, required_lengths, dict.fromkeys(integer_nodes, float), bounds)
+
+    overflowing: set[SequenceInstance] = set()
+    for node in integer_nodes:
+        with np.errstate(invalid="ignore"):
+            is_in_bounds = bool(np.all(np.abs(bounds[node]) < int64_bound))
+        if not is_in_bounds or any(operand in overflowing for operand in node.operands):
+            overflowing.add(node)
+
+    if len(overflowing) == 0:
+        return [values[target] for target in targets]
+
+    # Evaluate overflowing nodes again, along with everything that uses their operands
+    leaf_dtypes: dict[SequenceInstance, type] = dict.fromkeys(order, np.int64)
+    stale: set[SequenceInstance] = set()
+
+    def mark_stale(node: SequenceInstance):
+        if node in stale:
+            return
+        stale.add(node)
+        if len(node.operands) == 0:
+            leaf_dtypes[node] = overflow_dtype
+        for operand in node.operands:
+            mark_stale(operand)
+
+    for node in overflowing:
+        mark_stale(node)
+    for node in order:
+        if any(operand in stale for operand in node.operands):
+            stale.add(node)
+
+    evaluate_nodes((node for node in order if node in stale), required_lengths, leaf_dtypes, values)
+
+    return [values[target] for target in targets]
 
 
 # ======== TARGETS ======== #
@@ -130,42 +412,136 @@ sequences: Final[list[SequenceInstance]] = [
 
 
 # ======== GENERATION ======== #
-def main():
+def round_values(values: NDArray) -> NDArray:
+    """Rounds values to the set number of decimals, keeping exact integers exact"""
+    if values.dtype == object:
+        return np.array([round(value, round_decimals) for value in values.flat], dtype=object).reshape(values.shape)
+    # Values that have overflowed to inf stay inf
+    with np.errstate(over="ignore"):
+        return np.round(values, round_decimals)
+
+
+def to_float_values(values: NDArray) -> NDArray:
+    """Converts exact values to float64 for the binary output types, with too large values becoming inf"""
+    if values.dtype != object:
+        return values
+    def to_float(value):
+        try:
+            return float(value)
+        except OverflowError:
+            return math.inf if value > 0 else -math.inf
+    return np.array([to_float(value) for value in values.flat], dtype=float).reshape(values.shape)
+
+
+def format_output(values: Sequence[NDArray]) -> str:
+    """Formats values of each sequence as text in accordance with the settings"""
 
-    # Generate sequences
-    print("Generating sequences...")
     output_strings = list()
 
-    for i, sequence in enumerate(sequences):
-        # Take rounding and length into account
-        values = map(lambda x: round(x, round_decimals), islice(sequence.values, sequence_length))
-        string_values = map(str, values)
+    for i, (sequence, sequence_values) in enumerate(zip(sequences, values)):
         # Format sequence elements
+        string_values = map(str, sequence_values.tolist())
         sequence_string = sequence_format.format(sequence=element_separator.join(string_values), index=i)
         # Format comments
         comments_string = comment_separator.join(map(lambda s: comment_format.format(text=s), sequence.comments))
         # Concat for output
         output_strings.append(f"{comments_string}{separator_between_comment_and_sequence}{sequence_string}")
 
-    output_payload = output_format.format(sequences=sequence_separator.join(output_strings))
+    return output_format.format(sequences=sequence_separator.join(output_strings))
+
+
+# Numpy writers are given open files so that they do not append their own extensions
+def write_npy(path: Path, values: NDArray):
+    with path.open("wb") as file:
+        np.save(file, values)
+
+
+def write_npz(path: Path, values: NDArray):
+    arrays = {sequence_name_format.format(index=i): sequence_values for i, sequence_values in enumerate(values)}
+    comments = np.array(["\n".join(sequence.comments) for sequence in sequences], dtype=str)
+    with path.open("wb") as file:
+        np.savez(file, comments=comments, **arrays)
+
+
+def write_csv(path: Path, values: NDArray):
+    # Values are written with repr, the shortest text that is read back as the same float64
+    header = ",".join(sequence_name_format.format(index=i) for i in range(len(values)))
+    with path.open("w") as file:
+        file.write(header)
+        file.write("\n")
+        for row in values.T.tolist():
+            file.write(",".join(map(repr, row)))
+            file.write("\n")
+
+
+def write_matrix(path: Path, values: NDArray):
+
+    # The writer is in the imports directory next to this script's directory
+    imports_directory = str(Path(__file__).resolve().parent.parent / "imports")
+    if imports_directory not in sys.path:
+        sys.path.append(imports_directory)
+    from matrix_file_io import MatrixSeriesWriter
+
+    with MatrixSeriesWriter(str(path)) as file:
+        file.write_matrix(values)
+
+
+# Writers of the output file types other than "text"
+output_writers: Final[dict[str, Callable[[Path, NDArray], None]]] = {
+    "npy": write_npy,
+    "npz": write_npz,
+    "csv": write_csv,
+    "matrix": write_matrix,
+}
+
+
+def main() -> int:
+    """Returns the exit status, which is 1 if the script has failed."""
+
+    # Check some settings
+    if output_file_type != "text" and output_file_type not in output_writers:
+        print(f"Unknown output file type \"{output_file_type}\". Aborting.")
+        return 1
+
+    # Generate sequences
+    print("Generating sequences...")
+    # Only format text if it is used, exact integers are not needed otherwise
+    is_text_used = print_to_console or (output_file is not None and output_file_type == "text")
+    values = evaluate_sequences(sequences, sequence_length, overflow_dtype=object if is_text_used else float)
+
+    # Take rounding into account
+    values = [round_values(sequence_values) for sequence_values in values]
+
+    output_payload: str | None = None
+    if is_text_used:
+        output_payload = format_output(values)
 
     print("Writing output...")
     # Write to file
     if output_file is not None:
-        bytes_written = Path(output_file).write_text(output_payload)
-        print(f"{bytes_written} bytes written to \"{output_file}\"")
+        output_path = Path(output_file)
+        if output_file_type == "text":
+            output_path.write_text(output_payload)
+        else:
+            float_values = np.array([to_float_values(sequence_values) for sequence_values in values], dtype=float)
+            output_writers[output_file_type](output_path, float_values)
+        print(f"{output_path.stat().st_size} bytes written to \"{output_file}\"")
 
     # Write to console
     if print_to_console:
         print("Generated sequences:")
         print(output_payload)
 
+    return 0
+
 
 if __name__ == "__main__":
+    exit_status = 1
     try:
-        main()
+        exit_status = main()
         input("Press enter to exit")
     except Exception:
         print("An error has occurred:")
         print(format_exc())
         input("Press enter to exit")
+    sys.exit(exit_status)